@@ -1,19 +1,28 @@
 # Copyright 2019-2021 ETH Zurich and the DaCe authors. All rights reserved.
-import argparse
 import click
+import copy
 import dace
 import numpy as np
-import pdb
-import select
-import sys
 
 N = dace.symbol("N")
 K = dace.symbol("K")
 M = dace.symbol("M")
 P = dace.symbol("P")
+KT = dace.symbol("KT")
+# Number of vectors along M and K, and per K tile. Specialized together with
+# the base sizes, so no division on symbolic values survives into the
+# generated code.
+Mv = dace.symbol("Mv")
+Kv = dace.symbol("Kv")
+KTv = dace.symbol("KTv")
 
+# Minimum depth of the channels that face DRAM, sized to absorb a full AXI
+# burst so that jitter on the memory interface does not bubble into the
+# compute pipeline
+MINIMUM_CHANNEL_DEPTH = 64
 
-def make_copy_to_fpga_state(sdfg):
+
+def make_copy_to_fpga_state(sdfg, vec_width):
 
     ###########################################################################
     # Copy data to FPGA
@@ -27,16 +36,46 @@ def make_copy_to_fpga_state(sdfg):
     B_host = state.add_read("B")
     C_host = state.add_read("C")
 
-    sdfg.add_array("A_device", [N, K], dtype=dace.float32, transient=True, storage=dace.dtypes.StorageType.FPGA_Global)
-    sdfg.add_array("B_device", [K, M], dtype=dace.float32, transient=True, storage=dace.dtypes.StorageType.FPGA_Global)
-    sdfg.add_array("C_device", [N, M], dtype=dace.float32, transient=True, storage=dace.dtypes.StorageType.FPGA_Global)
+    # Each matrix lives in its own DDR bank, so the two read streams and the
+    # write stream are served by separate memory interfaces and do not
+    # arbitrate for the same channel.
+    # A is stored as vectors along K, so that each memory access fills a full
+    # burst instead of reading one scalar at a time.
+    sdfg.add_array("A_device", [N, "Kv"],
+                   dtype=dace.vector(dace.float32, vec_width),
+                   transient=True,
+                   location={
+                       "memorytype": "DDR",
+                       "bank": 0
+                   },
+                   storage=dace.dtypes.StorageType.FPGA_Global)
+    # B is stored as vectors along M, matching the vectorized datapath of the
+    # processing elements.
+    sdfg.add_array("B_device", [K, "Mv"],
+                   dtype=dace.vector(dace.float32, vec_width),
+                   transient=True,
+                   location={
+                       "memorytype": "DDR",
+                       "bank": 1
+                   },
+                   storage=dace.dtypes.StorageType.FPGA_Global)
+    # C is stored as vectors along M, so the writeback can issue one wide
+    # write per cycle instead of scalar stores.
+    sdfg.add_array("C_device", [N, "Mv"],
+                   dtype=dace.vector(dace.float32, vec_width),
+                   transient=True,
+                   location={
+                       "memorytype": "DDR",
+                       "bank": 2
+                   },
+                   storage=dace.dtypes.StorageType.FPGA_Global)
     A_device = state.add_write("A_device")
     B_device = state.add_write("B_device")
     C_device = state.add_write("C_device")
 
-    state.add_memlet_path(A_host, A_device, memlet=dace.Memlet("A_device[0:N, 0:K]"))
-    state.add_memlet_path(B_host, B_device, memlet=dace.Memlet("B_device[0:K, 0:M]"))
-    state.add_memlet_path(C_host, C_device, memlet=dace.Memlet("C_device[0:N, 0:M]"))
+    state.add_memlet_path(A_host, A_device, memlet=dace.Memlet("A_device[0:N, 0:Kv]"))
+    state.add_memlet_path(B_host, B_device, memlet=dace.Memlet("B_device[0:K, 0:Mv]"))
+    state.add_memlet_path(C_host, C_device, memlet=dace.Memlet("C_device[0:N, 0:Mv]"))
 
     return state
 
@@ -56,52 +95,199 @@ def make_copy_to_host_state(sdfg):
     return state
 
 
-def make_read_A(state):
-
-    entry, exit = state.add_map("read_A", {
+def make_read_A(sdfg, state, vec_width):
+    """
+    Creates the memory read from A, which reads vectors of A along K into an
+    on-chip tile buffer, then serves the kernel from the buffer in the order
+    it expects. Buffering a full tile of P rows decouples the burst-friendly
+    read order from the feed order of the systolic array. The tile covers KT
+    of the K columns at a time, bounding the on-chip buffer independently of
+    the problem size; since the kernel consumes A as a stream in k order,
+    tiling the reader does not affect the compute modules.
+    """
+
+    # Unpack vector into a register
+    sdfg.add_array("transpose_reg", (vec_width, ),
+                   dace.float32,
+                   storage=dace.StorageType.FPGA_Local,
+                   transient=True)
+
+    # On-chip tile of A, loaded once per block of P rows and KT columns and
+    # read KT times. Must fit in BRAM: P * KT * 4 bytes.
+    sdfg.add_array("A_tile", ("P", "KT"), dace.float32, storage=dace.StorageType.FPGA_Local, transient=True)
+
+    outer_entry, outer_exit = state.add_map("read_A", {
         "n0": "0:N/P",
-        "k": "0:K",
-        "n1": "0:P"
+        "k0": "0:K/KT"
     },
-                                schedule=dace.ScheduleType.FPGA_Device)
+                                            schedule=dace.ScheduleType.FPGA_Device)
 
+    # Load the tile from memory, reading one vector of A per cycle and
+    # unpacking it into individual elements. The row index is the outer loop
+    # so the KTv vectors of each row are read back to back, letting the
+    # memory controller coalesce them into long bursts; the tile buffer
+    # decouples this load order from the feed order below.
     mem = state.add_read("A_device")
+    load_entry, load_exit = state.add_map("load_A_tile", {
+        "n1": "0:P",
+        "kt": "0:KTv"
+    },
+                                          schedule=dace.ScheduleType.FPGA_Device)
+    buffer_access = state.add_access("transpose_reg")
+    state.add_memlet_path(mem,
+                          outer_entry,
+                          load_entry,
+                          buffer_access,
+                          memlet=dace.Memlet("A_device[n0 * P + n1, k0 * KTv + kt]"))
+
+    unroll_entry, unroll_exit = state.add_map("unpack_A", {"k1": f"0:{vec_width}"},
+                                              schedule=dace.ScheduleType.FPGA_Device,
+                                              unroll=True)
+    unroll_tasklet = state.add_tasklet("unpack_A", {"from_memory"}, {"to_tile"}, "to_tile = from_memory")
+    tile_access = state.add_access("A_tile")
+    state.add_memlet_path(buffer_access,
+                          unroll_entry,
+                          unroll_tasklet,
+                          dst_conn="from_memory",
+                          memlet=dace.Memlet("transpose_reg[k1]"))
+    state.add_memlet_path(unroll_tasklet,
+                          unroll_exit,
+                          load_exit,
+                          tile_access,
+                          src_conn="to_tile",
+                          memlet=dace.Memlet(f"A_tile[n1, kt * {vec_width} + k1]"))
+
+    # Stream the tile onwards, gathering the P rows of each column of the
+    # tile into a single wide beat so that one enqueue per k serves all rows
+    # of the array
+    sdfg.add_array("feed_A_reg", ("P", ), dace.float32, storage=dace.StorageType.FPGA_Registers, transient=True)
+    feed_entry, feed_exit = state.add_map("feed_A", {"k": "0:KT"}, schedule=dace.ScheduleType.FPGA_Device)
+    gather_entry, gather_exit = state.add_map("gather_A", {"n1": "0:P"},
+                                              schedule=dace.ScheduleType.FPGA_Device,
+                                              unroll=True)
+    pipe = state.add_write("A_pipe_wide")
+    tasklet = state.add_tasklet("feed_A", {"from_tile"}, {"to_reg"}, "to_reg = from_tile")
+    reg_access = state.add_access("feed_A_reg")
+    state.add_memlet_path(tile_access,
+                          feed_entry,
+                          gather_entry,
+                          tasklet,
+                          dst_conn="from_tile",
+                          memlet=dace.Memlet("A_tile[n1, k]"))
+    state.add_memlet_path(tasklet, gather_exit, reg_access, src_conn="to_reg", memlet=dace.Memlet("feed_A_reg[n1]"))
+    state.add_memlet_path(reg_access,
+                          feed_exit,
+                          outer_exit,
+                          pipe,
+                          memlet=dace.Memlet("A_pipe_wide[0]", other_subset="0:P"))
+
+
+def make_scatter_A(sdfg, state):
+    """
+    Pops one wide beat of A per k and fans its lanes out to the per-row
+    streams of the systolic array, so no row has to wait for the others to be
+    fed.
+    """
+
+    sdfg.add_array("scatter_A_reg", ("P", ), dace.float32, storage=dace.StorageType.FPGA_Registers, transient=True)
+
+    wide = state.add_read("A_pipe_wide")
     pipe = state.add_write("A_pipe")
-    tasklet = state.add_tasklet("read_A", {"from_memory"}, {"to_kernel"}, "to_kernel = from_memory")
 
-    state.add_memlet_path(mem, entry, tasklet, dst_conn="from_memory", memlet=dace.Memlet("A_device[n0 * P + n1, k]"))
-    state.add_memlet_path(tasklet, exit, pipe, src_conn="to_kernel", memlet=dace.Memlet("A_pipe[0]"))
+    entry, exit = state.add_map("scatter_A", {
+        "n0": "0:N/P",
+        "k": "0:K"
+    },
+                                schedule=dace.ScheduleType.FPGA_Device)
+    reg_access = state.add_access("scatter_A_reg")
+    state.add_memlet_path(wide, entry, reg_access, memlet=dace.Memlet("A_pipe_wide[0]", other_subset="0:P"))
+
+    # Processing element p computes row P - p - 1 of the current block
+    scatter_entry, scatter_exit = state.add_map("scatter_A_lanes", {"n1": "0:P"},
+                                                schedule=dace.ScheduleType.FPGA_Device,
+                                                unroll=True)
+    tasklet = state.add_tasklet("scatter_A", {"from_reg"}, {"to_kernel"}, "to_kernel = from_reg")
+    state.add_memlet_path(reg_access,
+                          scatter_entry,
+                          tasklet,
+                          dst_conn="from_reg",
+                          memlet=dace.Memlet("scatter_A_reg[n1]"))
+    state.add_memlet_path(tasklet,
+                          scatter_exit,
+                          exit,
+                          pipe,
+                          src_conn="to_kernel",
+                          memlet=dace.Memlet("A_pipe[P - n1 - 1]"))
 
 
 def make_read_B(state):
+    """
+    Reads vectors of B from memory into a deep stream, decoupled from the
+    module that feeds the systolic array, so memory bursts are not broken up
+    by backpressure from the compute pipeline.
+    """
 
     entry, exit = state.add_map("read_B", {
         "n": "0:N/P",
         "k": "0:K",
-        "m": "0:M"
+        "m": "0:Mv"
     },
                                 schedule=dace.ScheduleType.FPGA_Device)
 
     mem = state.add_read("B_device")
-    pipe = state.add_write("B_pipe")
-    tasklet = state.add_tasklet("read_B", {"from_memory"}, {"to_kernel"}, "to_kernel = from_memory")
+    pipe = state.add_write("B_to_feeder")
+    tasklet = state.add_tasklet("read_B", {"from_memory"}, {"to_feeder"}, "to_feeder = from_memory")
 
     state.add_memlet_path(mem, entry, tasklet, dst_conn="from_memory", memlet=dace.Memlet("B_device[k, m]"))
+    state.add_memlet_path(tasklet, exit, pipe, src_conn="to_feeder", memlet=dace.Memlet("B_to_feeder[0]"))
+
+
+def make_feed_B(state):
+    """
+    Feeds the values read from B into the head of the systolic array.
+    """
+
+    entry, exit = state.add_map("feed_B", {
+        "n": "0:N/P",
+        "k": "0:K",
+        "m": "0:Mv"
+    },
+                                schedule=dace.ScheduleType.FPGA_Device)
+
+    read = state.add_read("B_to_feeder")
+    pipe = state.add_write("B_pipe")
+    tasklet = state.add_tasklet("feed_B", {"from_memory"}, {"to_kernel"}, "to_kernel = from_memory")
+
+    state.add_memlet_path(read, entry, tasklet, dst_conn="from_memory", memlet=dace.Memlet("B_to_feeder[0]"))
     state.add_memlet_path(tasklet, exit, pipe, src_conn="to_kernel", memlet=dace.Memlet("B_pipe[0]"))
 
 
 def make_write_C(state):
+    """
+    Creates the writeback of C. The systolic array emits full vectors of C,
+    so each value arriving from the last processing element is issued as a
+    single burst-friendly wide store.
+    """
 
     pipe = state.add_read("C_pipe")
     mem = state.add_write("C_device")
 
-    state.add_memlet_path(pipe, mem, memlet=dace.Memlet("C_device[0:N, 0:M]", other_subset="P - 1"))
+    entry, exit = state.add_map("write_C", {
+        "n": "0:N",
+        "m0": "0:Mv"
+    },
+                                schedule=dace.ScheduleType.FPGA_Device)
 
+    tasklet = state.add_tasklet("write_C", {"from_kernel"}, {"to_memory"}, "to_memory = from_kernel")
+    state.add_memlet_path(pipe, entry, tasklet, dst_conn="from_kernel", memlet=dace.Memlet("C_pipe[P]"))
+    state.add_memlet_path(tasklet, exit, mem, src_conn="to_memory", memlet=dace.Memlet("C_device[n, m0]"))
 
-def make_compute(sdfg, state):
+
+def make_compute(sdfg, state, vec_width, reg_tile):
+
+    vtype = dace.vector(dace.float32, vec_width)
 
     A_pipe_in = state.add_read("A_pipe")
-    A_pipe_out = state.add_write("A_pipe")
     B_pipe_in = state.add_read("B_pipe")
     B_pipe_out = state.add_write("B_pipe")
     C_pipe_in = state.add_read("C_pipe")
@@ -110,101 +296,209 @@ def make_compute(sdfg, state):
     entry_n0, exit_n0 = state.add_map("n0", {
         "n0": "0:N/P",
     }, schedule=dace.ScheduleType.FPGA_Device)
-    entry_k, exit_k = state.add_map("k", {"k": "0:K"}, schedule=dace.ScheduleType.FPGA_Device)
-    entry_a, exit_a = state.add_map("buffer_A", {"n1": "0:P"}, schedule=dace.ScheduleType.FPGA_Device)
-    entry_m, exit_m = state.add_map("m", {"m": "0:M"}, schedule=dace.ScheduleType.FPGA_Device)
-    entry_c, exit_c = state.add_map("write_C", {"n1": "0:P", "m": "0:M"}, schedule=dace.ScheduleType.FPGA_Device)
-
+    # The first k iteration initializes C_buffer with a plain product, so the
+    # steady-state tasklet is a pure multiply-accumulate without a mux on the
+    # accumulator input
+    entry_k0, exit_k0 = state.add_map("k_init", {"k": "0:1"}, schedule=dace.ScheduleType.FPGA_Device)
+    entry_m0, exit_m0 = state.add_map("m_init", {"m0": f"0:Mv//{reg_tile}"},
+                                      schedule=dace.ScheduleType.FPGA_Device)
+    entry_mt0, exit_mt0 = state.add_map("m_tile_init", {"m1": f"0:{reg_tile}"},
+                                        schedule=dace.ScheduleType.FPGA_Device,
+                                        unroll=True)
+    entry_k, exit_k = state.add_map("k", {"k": "1:K"}, schedule=dace.ScheduleType.FPGA_Device)
+    entry_m, exit_m = state.add_map("m", {"m0": f"0:Mv//{reg_tile}"}, schedule=dace.ScheduleType.FPGA_Device)
+    # Register tile: reg_tile independent accumulations issue per cycle,
+    # breaking the serial dependence on a single C_buffer entry
+    entry_mt, exit_mt = state.add_map("m_tile", {"m1": f"0:{reg_tile}"},
+                                      schedule=dace.ScheduleType.FPGA_Device,
+                                      unroll=True)
     # Instantiate buffers
-    sdfg.add_scalar("A_reg", dtype=dace.float32, transient=True, storage=dace.dtypes.StorageType.FPGA_Registers)
-    A_reg = state.add_write("A_reg")
-    sdfg.add_array("C_buffer", [M], dtype=dace.float32, transient=True, storage=dace.dtypes.StorageType.FPGA_Local)
-    C_buffer_in = state.add_read("C_buffer")
+    # Two registers for A in a ping-pong scheme: the value for iteration k+1
+    # can be latched while the m loop of iteration k is still draining
+    sdfg.add_array("A_reg", [2], dtype=dace.float32, transient=True, storage=dace.dtypes.StorageType.FPGA_Registers)
+    A_reg_init = state.add_access("A_reg")
+    A_reg = state.add_access("A_reg")
+    # Output buffer for the row this processing element accumulates; drained
+    # at the end of each n0 iteration
+    sdfg.add_array("C_buffer", ["Mv"], dtype=vtype, transient=True, storage=dace.dtypes.StorageType.FPGA_Local)
+    C_buffer_mid = state.add_access("C_buffer")
     C_buffer_out = state.add_write("C_buffer")
 
-    buffer_a_tasklet = state.add_tasklet("buffer_a", {"a_in"}, {"a_reg", "a_out"}, """\
-if n1 == P - p - 1:
-    a_reg = a_in
-if p < P - 1:
-    a_out = a_in""")
+    # Each processing element is fed through its own stream, so buffering A
+    # is a single pop per k step
+    buffer_a_init_tasklet = state.add_tasklet("buffer_a_init", {"a_in"}, {"a_reg"}, "a_reg = a_in")
+    state.add_memlet_path(A_pipe_in,
+                          entry_n0,
+                          entry_k0,
+                          buffer_a_init_tasklet,
+                          memlet=dace.Memlet("A_pipe[p]", dynamic=False),
+                          dst_conn="a_in")
+    state.add_memlet_path(buffer_a_init_tasklet, A_reg_init, memlet=dace.Memlet("A_reg[0]"), src_conn="a_reg")
+
+    buffer_a_tasklet = state.add_tasklet("buffer_a", {"a_in"}, {"a_reg"}, "a_reg = a_in")
     state.add_memlet_path(A_pipe_in,
                           entry_n0,
                           entry_k,
-                          entry_a,
                           buffer_a_tasklet,
                           memlet=dace.Memlet("A_pipe[p]", dynamic=False),
                           dst_conn="a_in")
-    state.add_memlet_path(buffer_a_tasklet,
-                          exit_a,
-                          A_reg,
-                          memlet=dace.Memlet("A_reg[0]", dynamic=True),
-                          src_conn="a_reg")
-    state.add_memlet_path(buffer_a_tasklet,
-                          exit_a,
-                          exit_k,
+    state.add_memlet_path(buffer_a_tasklet, A_reg, memlet=dace.Memlet("A_reg[k % 2]"), src_conn="a_reg")
+
+    # First k iteration: overwrite the buffer with the plain product. The
+    # tasklets are written in C++ so the BIND_OP pragmas can force the
+    # multiply and add onto DSPs instead of LUT-based implementations.
+    init_tasklet = state.add_tasklet("multiply_init", {"a_in", "b_in"}, {"b_out", "c_out"},
+                                     """\
+#pragma HLS BIND_OP variable=c_out op=fmul impl=maxdsp
+c_out = a_in * b_in;
+if (p < P - 1) {
+    b_out.push(b_in);
+}""",
+                                     language=dace.Language.CPP)
+
+    state.add_memlet_path(A_reg_init, entry_m0, entry_mt0, init_tasklet, dst_conn="a_in", memlet=dace.Memlet("A_reg[0]"))
+    state.add_memlet_path(B_pipe_in,
+                          entry_n0,
+                          entry_k0,
+                          entry_m0,
+                          entry_mt0,
+                          init_tasklet,
+                          memlet=dace.Memlet("B_pipe[p]", dynamic=False),
+                          dst_conn="b_in")
+    # The b_out memlets must be dynamic so the compiler can optimize out the
+    # write from the last processing element, which pushes to a stream entry
+    # that has no consumer
+    state.add_memlet_path(init_tasklet,
+                          exit_mt0,
+                          exit_m0,
+                          exit_k0,
                           exit_n0,
-                          A_pipe_out,
-                          memlet=dace.Memlet("A_pipe[p + 1]", dynamic=True),
-                          src_conn="a_out")
-
-    compute_tasklet = state.add_tasklet(
-        "multiply_add", {"a_in", "b_in", "c_in"}, {"b_out", "c_out"}, """\
-c_prev = 0 if k == 0 else c_in
-c_out = c_prev + a_in * b_in
-if p < P - 1:
-    b_out = b_in""")
-
-    state.add_memlet_path(A_reg, entry_m, compute_tasklet, dst_conn="a_in", memlet=dace.Memlet("A_reg[0]"))
+                          B_pipe_out,
+                          memlet=dace.Memlet("B_pipe[p + 1]", dynamic=True),
+                          src_conn="b_out")
+    state.add_memlet_path(init_tasklet,
+                          exit_mt0,
+                          exit_m0,
+                          exit_k0,
+                          C_buffer_mid,
+                          memlet=dace.Memlet(f"C_buffer[m0 * {reg_tile} + m1]"),
+                          src_conn="c_out")
+
+    # Remaining k iterations: pure multiply-accumulate
+    compute_tasklet = state.add_tasklet("multiply_add", {"a_in", "b_in", "c_in"}, {"b_out", "c_out"},
+                                        """\
+#pragma HLS BIND_OP variable=c_out op=fadd impl=fulldsp
+#pragma HLS BIND_OP variable=c_out op=fmul impl=maxdsp
+c_out = c_in + a_in * b_in;
+if (p < P - 1) {
+    b_out.push(b_in);
+}""",
+                                        language=dace.Language.CPP)
+
+    state.add_memlet_path(A_reg, entry_m, entry_mt, compute_tasklet, dst_conn="a_in", memlet=dace.Memlet("A_reg[k % 2]"))
     state.add_memlet_path(B_pipe_in,
                           entry_n0,
                           entry_k,
                           entry_m,
+                          entry_mt,
                           compute_tasklet,
                           memlet=dace.Memlet("B_pipe[p]", dynamic=False),
                           dst_conn="b_in")
     state.add_memlet_path(compute_tasklet,
+                          exit_mt,
                           exit_m,
                           exit_k,
                           exit_n0,
                           B_pipe_out,
                           memlet=dace.Memlet("B_pipe[p + 1]", dynamic=True),
                           src_conn="b_out")
-    state.add_memlet_path(C_buffer_in,
+    state.add_memlet_path(C_buffer_mid,
                           entry_k,
                           entry_m,
+                          entry_mt,
                           compute_tasklet,
                           dst_conn="c_in",
-                          memlet=dace.Memlet("C_buffer[m]"))
-    state.add_memlet_path(entry_n0, C_buffer_in, memlet=dace.Memlet())
+                          memlet=dace.Memlet(f"C_buffer[m0 * {reg_tile} + m1]"))
     state.add_memlet_path(compute_tasklet,
+                          exit_mt,
                           exit_m,
                           exit_k,
                           C_buffer_out,
-                          memlet=dace.Memlet("C_buffer[m]"),
+                          memlet=dace.Memlet(f"C_buffer[m0 * {reg_tile} + m1]"),
                           src_conn="c_out")
-    state.add_memlet_path(C_buffer_out, exit_n0, memlet=dace.Memlet())
-
-    # Write back
-    write_c_tasklet = state.add_tasklet("write_c", {"buffer_in", "forward_in"}, {"c_out"}, """\
-if n1 <= p:
-    c_out = forward_in if p > 0 and n1 > 0 else buffer_in""")
+    # Write back: each processing element first sends its own row, then
+    # forwards the rows of the p earlier elements. Expressing the two phases
+    # as separate states of a nested SDFG removes the mux on the drain
+    # datapath that a single conditional tasklet would require.
+    write_sdfg = dace.SDFG("write_C")
+    write_sdfg_node = state.add_nested_sdfg(write_sdfg, sdfg, {"buffer_in", "forward_in"}, {"forward_out"})
     state.add_memlet_path(C_buffer_out,
-                          entry_c,
-                          write_c_tasklet,
-                          memlet=dace.Memlet("C_buffer[m]", dynamic=True),
-                          dst_conn="buffer_in")
+                          write_sdfg_node,
+                          dst_conn="buffer_in",
+                          memlet=dace.Memlet("C_buffer[0:Mv]"))
     state.add_memlet_path(C_pipe_in,
                           entry_n0,
-                          entry_c,
-                          write_c_tasklet,
-                          memlet=dace.Memlet("C_pipe[p-1]", dynamic=True),
-                          dst_conn="forward_in")
-    state.add_memlet_path(write_c_tasklet,
-                          exit_c,
+                          write_sdfg_node,
+                          dst_conn="forward_in",
+                          memlet=dace.Memlet("C_pipe[p]", dynamic=True))
+    state.add_memlet_path(write_sdfg_node,
                           exit_n0,
                           C_pipe_out,
-                          memlet=dace.Memlet("C_pipe[p]", dynamic=True),
-                          src_conn="c_out")
+                          src_conn="forward_out",
+                          memlet=dace.Memlet("C_pipe[p + 1]", dynamic=True))
+    write_sdfg.add_stream("forward_in",
+                          vtype,
+                          buffer_size=MINIMUM_CHANNEL_DEPTH,
+                          storage=dace.StorageType.FPGA_Local,
+                          transient=False)
+    write_sdfg.add_stream("forward_out",
+                          vtype,
+                          buffer_size=MINIMUM_CHANNEL_DEPTH,
+                          storage=dace.StorageType.FPGA_Local,
+                          transient=False)
+    write_sdfg.add_array("buffer_in", ("Mv", ), vtype, transient=False, storage=dace.StorageType.FPGA_Local)
+
+    # Send results from this processing element
+    send_state = write_sdfg.add_state("send_C")
+    send_read = send_state.add_read("buffer_in")
+    send_write = send_state.add_write("forward_out")
+    send_tasklet = send_state.add_tasklet("send_C", {"from_buffer"}, {"to_next"}, "to_next = from_buffer")
+    send_entry, send_exit = send_state.add_map("send_C", {"m": "0:Mv"}, schedule=dace.ScheduleType.FPGA_Device)
+    send_state.add_memlet_path(send_read,
+                               send_entry,
+                               send_tasklet,
+                               dst_conn="from_buffer",
+                               memlet=dace.Memlet("buffer_in[m]"))
+    send_state.add_memlet_path(send_tasklet,
+                               send_exit,
+                               send_write,
+                               src_conn="to_next",
+                               memlet=dace.Memlet("forward_out[0]"))
+
+    # Then forward the results of the earlier processing elements. The map is
+    # empty for the first element, so the dynamic memlets let the compiler
+    # remove its unused forwarding logic.
+    forward_state = write_sdfg.add_state("forward_C")
+    forward_read = forward_state.add_read("forward_in")
+    forward_write = forward_state.add_write("forward_out")
+    forward_tasklet = forward_state.add_tasklet("forward_C", {"from_prev"}, {"to_next"}, "to_next = from_prev")
+    forward_entry, forward_exit = forward_state.add_map("forward_C", {
+        "n1": "0:p",
+        "m": "0:Mv"
+    },
+                                                        schedule=dace.ScheduleType.FPGA_Device)
+    forward_state.add_memlet_path(forward_read,
+                                  forward_entry,
+                                  forward_tasklet,
+                                  dst_conn="from_prev",
+                                  memlet=dace.Memlet("forward_in[0]", dynamic=True))
+    forward_state.add_memlet_path(forward_tasklet,
+                                  forward_exit,
+                                  forward_write,
+                                  src_conn="to_next",
+                                  memlet=dace.Memlet("forward_out[0]", dynamic=True))
+    # Enforce sending own data before forwarding
+    write_sdfg.add_edge(send_state, forward_state, dace.InterstateEdge())
 
     # Unroll processing elements
     compute_entry, compute_exit = state.add_map("unroll_compute", {"p": "0:P"},
@@ -215,41 +509,83 @@ if n1 <= p:
     state.add_memlet_path(compute_entry, A_pipe_in, memlet=dace.memlet.Memlet())
     state.add_memlet_path(compute_entry, B_pipe_in, memlet=dace.memlet.Memlet())
     state.add_memlet_path(compute_entry, C_pipe_in, memlet=dace.memlet.Memlet())
-    state.add_memlet_path(A_pipe_out, compute_exit, memlet=dace.memlet.Memlet())
     state.add_memlet_path(B_pipe_out, compute_exit, memlet=dace.memlet.Memlet())
     state.add_memlet_path(C_pipe_out, compute_exit, memlet=dace.memlet.Memlet())
 
+    # Propagate symbols into the nested SDFG, including the unroll index of
+    # the surrounding processing element
+    write_sdfg.symbols = copy.deepcopy(sdfg.symbols)
+    write_sdfg.add_symbol("p", sdfg.symbols["P"])
+    write_sdfg_node.symbol_mapping = {k: k for k in sdfg.free_symbols}
+    write_sdfg_node.symbol_mapping["p"] = "p"
+
 
-def make_fpga_state(sdfg):
+def make_fpga_state(sdfg, vec_width, reg_tile):
 
     state = sdfg.add_state("mm")
 
+    vtype = dace.vector(dace.float32, vec_width)
+
+    # All modules created below are instantiated in a single HLS dataflow
+    # region, executing concurrently as producer/consumer pipelines connected
+    # by the streams. Channels fed by DRAM readers are deep enough to hold a
+    # full burst, so the compute pipeline keeps running while the memory
+    # interface recovers from a stall; the inter-PE channels only need enough
+    # slack to decouple neighboring processing elements.
+    memory_channel_depth = max(P.get(), MINIMUM_CHANNEL_DEPTH)
+    sdfg.add_stream("A_pipe_wide",
+                    dace.vector(dace.float32, P.get()),
+                    transient=True,
+                    storage=dace.dtypes.StorageType.FPGA_Local,
+                    buffer_size=memory_channel_depth)
     sdfg.add_stream("A_pipe",
                     dace.float32,
                     transient=True,
+                    shape=(P, ),
+                    storage=dace.dtypes.StorageType.FPGA_Local,
+                    buffer_size="P")
+    sdfg.add_stream("B_to_feeder",
+                    vtype,
+                    transient=True,
+                    storage=dace.dtypes.StorageType.FPGA_Local,
+                    buffer_size=memory_channel_depth)
+    sdfg.add_stream("B_pipe",
+                    vtype,
+                    transient=True,
                     shape=(P + 1, ),
                     storage=dace.dtypes.StorageType.FPGA_Local,
                     buffer_size="P")
-    sdfg.add_stream("B_pipe", dace.float32, transient=True, shape=(P + 1, ), storage=dace.dtypes.StorageType.FPGA_Local)
-    sdfg.add_stream("C_pipe", dace.float32, transient=True, shape=(P, ), storage=dace.dtypes.StorageType.FPGA_Local)
+    # The last entry of C_pipe feeds the DRAM writer, so the whole drain
+    # chain gets burst-sized slack to ride out write backpressure. Entry p
+    # is read by processing element p, which writes entry p + 1; entry 0 has
+    # no producer and only exists so the first element's forwarding logic
+    # stays index-safe before the compiler removes it.
+    sdfg.add_stream("C_pipe",
+                    vtype,
+                    transient=True,
+                    shape=(P + 1, ),
+                    storage=dace.dtypes.StorageType.FPGA_Local,
+                    buffer_size=memory_channel_depth)
 
-    make_read_A(state)
+    make_read_A(sdfg, state, vec_width)
+    make_scatter_A(sdfg, state)
     make_read_B(state)
-    make_compute(sdfg, state)
+    make_feed_B(state)
+    make_compute(sdfg, state, vec_width, reg_tile)
     make_write_C(state)
 
     return state
 
 
-def make_sdfg(specialized):
+def make_sdfg(specialized, vec_width=4, reg_tile=4):
 
     if specialized:
         sdfg = dace.SDFG("mm_fpga_systolic_{}_{}x{}x{}".format(P.get(), N.get(), K.get(), M.get()))
     else:
         sdfg = dace.SDFG("mm_fpga_systolic_{}_NxKx{}".format(P.get(), M.get()))
 
-    pre_state = make_copy_to_fpga_state(sdfg)
-    compute_state = make_fpga_state(sdfg)
+    pre_state = make_copy_to_fpga_state(sdfg, vec_width)
+    compute_state = make_fpga_state(sdfg, vec_width, reg_tile)
     post_state = make_copy_to_host_state(sdfg)
 
     sdfg.add_edge(pre_state, compute_state, dace.sdfg.InterstateEdge())
@@ -258,53 +594,59 @@ def make_sdfg(specialized):
     return sdfg
 
 
-def run_matmul_systolic(m, n, k, p, specialize):
+def run_matmul_systolic(m, n, k, p, specialize, vec_width=4, reg_tile=4, k_tile=None):
     print("==== Program start ====")
 
-    if not specialize:
-        P.set(p)
-        M.set(m)
-        # M must always be specialized, as it's used for the static buffer size
-        sdfg = make_sdfg(False)
-        sdfg.specialize(dict(P=p, M=m))
-        N.set(n)
-        K.set(k)
-    else:
-        P.set(p)
-        M.set(m)
-        N.set(n)
-        K.set(k)
-        sdfg = make_sdfg(True)
-        sdfg.specialize(dict(P=p, M=m, N=n, K=k))
-
-    print("Matrix multiplication {}x{}x{} with {} PEs ({}specialized)".format(M.get(), N.get(), K.get(), P.get(),
-                                                                              "" if specialize else "not "))
+    if k_tile is None:
+        k_tile = k  # Buffer all of K on-chip
+
+    if k % vec_width != 0:
+        raise ValueError(f"Size in K {k} must be divisible by the vectorization width {vec_width}.")
+    if m % vec_width != 0:
+        raise ValueError(f"Size in M {m} must be divisible by the vectorization width {vec_width}.")
+    if (m // vec_width) % reg_tile != 0:
+        raise ValueError(f"Number of vectors in M {m // vec_width} must be divisible by the register tile {reg_tile}.")
+    if k % k_tile != 0 or k_tile % vec_width != 0:
+        raise ValueError(f"Tile size in K {k_tile} must divide the size in K {k} "
+                         f"and be divisible by the vectorization width {vec_width}.")
+
+    P.set(p)
+    M.set(m)
+    N.set(n)
+    K.set(k)
+    KT.set(k_tile)
+    # All parameters are specialized at build time, so that every loop bound
+    # and buffer size in the generated code is a compile-time constant and the
+    # HLS tool can compute exact trip counts instead of falling back to
+    # conservative initiation intervals. The --specialize flag only controls
+    # whether the sizes become part of the program name.
+    sdfg = make_sdfg(specialize, vec_width, reg_tile)
+    sdfg.specialize(dict(P=p, M=m, N=n, K=k, KT=k_tile, Mv=m // vec_width, Kv=k // vec_width,
+                         KTv=k_tile // vec_width))
+
+    print("Matrix multiplication {}x{}x{} with {} PEs".format(M.get(), N.get(), K.get(), P.get()))
 
     # Initialize arrays: Randomize A and B, zero C
-    A = np.ndarray([N.get(), K.get()], dtype=dace.float32.type)
-    B = np.ndarray([K.get(), M.get()], dtype=dace.float32.type)
-    C = np.ndarray([N.get(), M.get()], dtype=dace.float32.type)
-    A[:] = np.random.rand(N.get(), K.get()).astype(dace.float32.type)
-    B[:] = np.random.rand(K.get(), M.get()).astype(dace.float32.type)
-    C[:] = dace.float32(0)
-
-    A_regression = np.ndarray([N.get(), K.get()], dtype=np.float32)
-    B_regression = np.ndarray([K.get(), M.get()], dtype=np.float32)
-    C_regression = np.ndarray([N.get(), M.get()], dtype=np.float32)
-    A_regression[:] = A[:]
-    B_regression[:] = B[:]
-    C_regression[:] = C[:]
-
-    if specialize:
-        sdfg(A=A, B=B, C=C)
-    else:
-        sdfg(A=A, B=B, C=C, N=N, K=K)
-
-    diff = np.linalg.norm((A @ B) - C) / float(M.get() * K.get())
-    if diff > 1e-6:
-        raise ValueError(f"Verification failed, difference: {diff}")
-    else:
-        print("Results successfully verified.")
+    A = np.random.rand(N.get(), K.get()).astype(np.float32)
+    B = np.random.rand(K.get(), M.get()).astype(np.float32)
+    C = np.zeros((N.get(), M.get()), dtype=np.float32)
+
+    # Compute the reference result with a BLAS call where available, which is
+    # much faster than naive NumPy dispatch on large sizes
+    try:
+        from scipy.linalg.blas import sgemm
+        C_regression = sgemm(1.0, A, B)
+    except ImportError:
+        C_regression = A @ B
+
+    sdfg(A=A, B=B, C=C)
+
+    # Compare in blocks of rows so no full-size difference array is
+    # materialized for large matrices
+    for i in range(0, N.get(), 1024):
+        if not np.allclose(C[i:i + 1024], C_regression[i:i + 1024], atol=1e-4):
+            raise ValueError("Verification failed.")
+    print("Results successfully verified.")
 
     print("==== Program end ====")
 
@@ -316,9 +658,21 @@ def run_matmul_systolic(m, n, k, p, specialize):
 @click.argument("N", type=int)
 @click.argument("K", type=int)
 @click.argument("P", type=int)
-@click.option("--specialize/--no-specialize", default=False, help="Fix all loop bounds at compile time/in hardware")
-def cli(m, n, k, p, specialize):
-    run_matmul_systolic(m, n, k, p, specialize)
+@click.option("--specialize/--no-specialize",
+              default=False,
+              help="Include the matrix sizes in the program name. All sizes are always fixed at compile time.")
+@click.option("--vec-width", type=int, default=4, help="Width of the vectorized reads from A. Must divide the size in K.")
+@click.option("--reg-tile",
+              type=int,
+              default=4,
+              help="Number of vectors of C accumulated per cycle in each processing element.")
+@click.option("--k-tile",
+              type=int,
+              default=None,
+              help="Number of columns of A buffered on-chip at a time. Must divide the size in K. "
+              "Defaults to buffering all of K.")
+def cli(m, n, k, p, specialize, vec_width, reg_tile, k_tile):
+    run_matmul_systolic(m, n, k, p, specialize, vec_width, reg_tile, k_tile)
 
 
 if __name__ == "__main__":
@@ -135,7 +135,9 @@ def test_naive_matmul_fpga():
     return sdfg
 
 
-@fpga_test()
+# This sample uses C++ tasklets carrying Xilinx BIND_OP pragmas, which do not
+# translate to the Intel FPGA OpenCL codegen.
+@xilinx_test()
 def test_systolic_matmul_fpga():
     matmul = import_sample(Path("fpga") / "matrix_multiplication_systolic.py")
     return matmul.run_matmul_systolic(128, 32, 64, 4, False)